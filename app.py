@@ -1,23 +1,75 @@
 # app.py
 """
 Flask web app (runs on port 5001).
+Use `python app.py` for development or `gunicorn app:app` (see gunicorn.conf.py) in production.
 This forwards prompts to a local model API assumed to be on port 5000.
-Sessions stored in memory.
+Sessions are persisted in SQLite (see session_store.py) so every worker shares them.
 """
 import os
+import re
 import time
 import uuid
-import traceback
-from typing import Optional, List, Dict, Tuple
+import queue
+import atexit
+import logging
+import logging.handlers
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Optional, List, Tuple, Iterator
+
+import orjson
+import httpx
+from flask import Flask, Response, jsonify, render_template, request
+from flask.json.provider import JSONProvider
+
+from session_store import SessionStore
+
+
+class OrjsonProvider(JSONProvider):
+    """JSON provider backed by orjson; used by jsonify() and request.get_json()."""
+
+    def dumps(self, obj, **kwargs) -> str:
+        return orjson.dumps(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        # skip the bytes -> str -> bytes round trip of the default implementation
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj), mimetype="application/json")
 
-import requests
-from flask import Flask, jsonify, render_template, request
 
 app = Flask(__name__, template_folder="templates", static_folder="static")
+app.json = OrjsonProvider(app)
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """Enqueue records untouched so message and traceback formatting run on the listener thread."""
+
+    def prepare(self, record):
+        return record
+
+
+# Request threads only enqueue log records; a listener thread formats and writes them
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+logger.propagate = False
+_log_queue = queue.Queue()
+logger.addHandler(_DeferredQueueHandler(_log_queue))
+_log_listener = logging.handlers.QueueListener(_log_queue, logging.StreamHandler())
+_log_listener.start()
+atexit.register(_log_listener.stop)
 
 # === Model config ===
 MODEL_HOST = os.environ.get("MODEL_HOST", "http://127.0.0.1:5000")
 
+# Dead endpoints should fail fast; generations may legitimately take a while
+MODEL_CONNECT_TIMEOUT = 1.0
+MODEL_READ_TIMEOUT = 60.0
+MODEL_STREAM_READ_TIMEOUT = 120.0
+
 # Candidate endpoints (we will try these in order; some servers support different shapes)
 MODEL_ENDPOINTS = [
     "/v1/chat/completions",   # OpenAI-style chat completions
@@ -28,27 +80,54 @@ MODEL_ENDPOINTS = [
 ]
 MODEL_URLS = [MODEL_HOST.rstrip("/") + ep for ep in MODEL_ENDPOINTS]
 
-# In-memory session store
-sessions: Dict[str, dict] = {}
+# Shared HTTP client with pooled keep-alive connections. HTTP/2 is only negotiated
+# over TLS, so it is enabled (and the optional h2 package needed) for https hosts only.
+_CLIENT = httpx.Client(
+    http2=MODEL_HOST.startswith("https://"),
+    limits=httpx.Limits(max_connections=50, max_keepalive_connections=20),
+    timeout=httpx.Timeout(MODEL_READ_TIMEOUT, connect=MODEL_CONNECT_TIMEOUT),
+    headers={"Content-Type": "application/json", "Accept": "application/json"},
+)
+atexit.register(_CLIENT.close)
+
+# Last (url, payload shape) that answered 200; shape is "chat" or "inputs".
+# Tried first on every call so the steady state costs a single request.
+_GOOD_ENDPOINT: Optional[Tuple[str, str]] = None
+_GOOD_ENDPOINT_LOCK = threading.Lock()
+
+# Endpoints that answered 4xx to a streaming request; stream_model() skips them
+_NO_STREAM_URLS = set()
+
+# Number of leading MODEL_URLS probed concurrently when no endpoint is cached
+HEDGE_WIDTH = 2
+_HEDGE_POOL = ThreadPoolExecutor(max_workers=4 * HEDGE_WIDTH, thread_name_prefix="model-probe")
+
+# Session store shared by all workers
+store = SessionStore(os.environ.get("SESSION_DB", "sessions.db"))
+atexit.register(store.close)
 
 # -----------------------------
 # Session Helpers
 # -----------------------------
 def create_session(name: Optional[str] = None) -> dict:
-    sid = str(uuid.uuid4())
+    sid = uuid.uuid4().hex
     session = {
         "id": sid,
-        "name": name or f"Chat {len(sessions) + 1}",
+        "name": name,  # store assigns "Chat N" when empty
         "created": time.time(),
-        "messages": []
+        "messages": [],
     }
-    sessions[sid] = session
+    store.create(session)
     return session
 
 
-def sort_sessions() -> List[dict]:
-    """Return sessions sorted by creation time (oldest first)."""
-    return sorted(sessions.values(), key=lambda x: x["created"])
+def record_message(sid: str, role: str, content: str) -> bool:
+    """
+    Persist a message to the chat history, keeping at most MAX_HISTORY_MESSAGES
+    stored. Returns False if the session was deleted meanwhile.
+    """
+    message = {"role": role, "content": content, "time": time.time()}
+    return store.append(sid, message, keep=MAX_HISTORY_MESSAGES)
 
 
 # -----------------------------
@@ -92,46 +171,288 @@ def extract_text_from_model_response(resp_json: dict) -> Tuple[str, dict]:
     return str(resp_json), resp_json
 
 
+# Specialized extractors: one indexed access each, no shape checks
+def _extract_openai_chat(resp_json: dict) -> str:
+    return resp_json["choices"][0]["message"]["content"]
+
+
+def _extract_openai_text(resp_json: dict) -> str:
+    return resp_json["choices"][0]["text"]
+
+
+def _extract_data_list(resp_json: dict) -> str:
+    return resp_json["data"][0]["text"]
+
+
+_SPECIALIZED_EXTRACTORS = (_extract_openai_chat, _extract_openai_text, _extract_data_list)
+
+# Extractor that matched the server's response shape last time (None until one does)
+_GOOD_EXTRACTOR = None
+
+
+def extract_reply_text(resp_json) -> str:
+    """
+    Extract reply text, trying the extractor bound for this server's response shape first.
+    On a miss, fall back to extract_text_from_model_response() and rebind to whichever
+    specialized extractor agrees with it.
+    """
+    global _GOOD_EXTRACTOR
+    extractor = _GOOD_EXTRACTOR
+    if extractor is not None:
+        try:
+            text = extractor(resp_json)
+            if isinstance(text, str):
+                return text
+        except (KeyError, IndexError, TypeError):
+            pass
+
+    text, raw = extract_text_from_model_response(resp_json)
+    for candidate in _SPECIALIZED_EXTRACTORS:
+        try:
+            if candidate(resp_json) == text:
+                _GOOD_EXTRACTOR = candidate
+                break
+        except (KeyError, IndexError, TypeError):
+            continue
+    return text
+
+
 # -----------------------------
 # Payload trimming helpers
 # -----------------------------
 MAX_MESSAGES = 24            # keep at most this many messages in the payload we send to the model
 MAX_TOTAL_CHARS = 14_000    # approximate safe total characters for messages payload
 MAX_MESSAGE_CHARS = 3_000   # trim any single message to this many characters
+MAX_HISTORY_MESSAGES = 200  # stored chat history per session (what the UI shows)
 
 def trim_messages(messages: List[dict]) -> List[dict]:
     """
     Trim a list of messages to keep the most recent messages while respecting
     MAX_MESSAGES and MAX_TOTAL_CHARS. Also trim individual messages to MAX_MESSAGE_CHARS.
-    Returns a new list (not in-place).
+    Single backward pass over the history.
+    Returns the input list unchanged when it already fits every limit,
+    otherwise a new list (never in-place).
     """
     if not messages:
         return messages
 
-    msgs = messages[-MAX_MESSAGES:]  # keep last N first
-    # trim individual message sizes (preserve role tag)
-    def trim_msg(m):
+    # common case: short history that needs no trimming at all
+    if len(messages) <= MAX_MESSAGES:
+        total = 0
+        for m in messages:
+            clen = len(m.get("content", ""))
+            if clen > MAX_MESSAGE_CHARS:
+                break
+            total += clen
+        else:
+            if total <= MAX_TOTAL_CHARS:
+                return messages
+
+    kept = deque()
+    running = 0
+    # walk newest -> oldest, stop as soon as either budget is exhausted
+    for m in reversed(messages):
+        if len(kept) >= MAX_MESSAGES:
+            break
         content = m.get("content", "")
+        clen = min(len(content), MAX_MESSAGE_CHARS)
+        if running + clen > MAX_TOTAL_CHARS:
+            break
         if len(content) > MAX_MESSAGE_CHARS:
             # keep tail (most recent) since context usually matters more recently
             content = content[-MAX_MESSAGE_CHARS:]
-        return {"role": m.get("role", "user"), "content": content}
+        kept.appendleft({"role": m.get("role", "user"), "content": content})
+        running += clen
 
-    msgs = [trim_msg(m) for m in msgs]
+    return list(kept)
+
+
+# -----------------------------
+# Robust Model Caller (patched)
+# -----------------------------
+def _remember_endpoint(url: str, shape: str) -> None:
+    """Cache the endpoint/payload shape that last succeeded."""
+    global _GOOD_ENDPOINT
+    with _GOOD_ENDPOINT_LOCK:
+        _GOOD_ENDPOINT = (url, shape)
 
-    # if total chars still too big, drop oldest until under limit
-    total_chars = sum(len(m["content"]) for m in msgs)
-    while total_chars > MAX_TOTAL_CHARS and len(msgs) > 1:
-        # drop the oldest message
-        msgs.pop(0)
-        total_chars = sum(len(m["content"]) for m in msgs)
 
-    return msgs
+def _read_model_reply(r) -> str:
+    """Extract text from a 200 response, falling back to the raw body."""
+    try:
+        return extract_reply_text(orjson.loads(r.content))
+    except Exception:
+        # not JSON — return raw text body
+        return r.text
 
 
 # -----------------------------
-# Robust Model Caller (patched)
+# Request coalescing (opt-in)
 # -----------------------------
+# When MODEL_BATCHING=1, chat calls that arrive within BATCH_WINDOW_MS of each other are
+# sent upstream as one {"messages_batch": [payload, ...]} request. The server is expected
+# to answer {"responses": [completion, ...]} in the same order.
+MODEL_BATCHING = os.environ.get("MODEL_BATCHING", "0") == "1"
+MAX_BATCH = 8
+BATCH_WINDOW_MS = 10
+
+
+class _BatchDispatcher:
+    """
+    Background thread that groups concurrent chat payloads into one upstream request.
+    submit() returns (ok, text), or None when the caller should send its own request:
+    a lone request in the window, a failed batch, a batch that outlives the wait bound,
+    or a server without batch support (a 4xx, or a 200 without a matching "responses"
+    list, turns batching off for the life of the process).
+    """
+
+    def __init__(self, max_batch: int = MAX_BATCH, timeout_ms: int = BATCH_WINDOW_MS):
+        self.max_batch = max_batch
+        self.timeout = timeout_ms / 1000
+        # longest a caller waits: collection window plus one full batch request
+        self.wait_timeout = self.timeout + MODEL_CONNECT_TIMEOUT + MODEL_READ_TIMEOUT
+        self.supported = True
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, payload: dict) -> Optional[Tuple[bool, str]]:
+        if not self.supported:
+            return None
+        with self._lock:
+            # (re)start the collector if it never started or has died
+            if self._thread is None or not self._thread.is_alive():
+                thread = threading.Thread(target=self._run, name="model-batcher", daemon=True)
+                try:
+                    thread.start()
+                except RuntimeError:
+                    return None
+                self._thread = thread
+        item = {"payload": payload, "done": threading.Event(), "result": None, "abandoned": False}
+        self._queue.put(item)
+        if not item["done"].wait(self.wait_timeout):
+            # give up on the batch; the caller sends its own request instead
+            item["abandoned"] = True
+            return None
+        return item["result"]
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.timeout
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            batch = [item for item in batch if not item["abandoned"]]
+            if len(batch) < 2:
+                self._scatter(batch, None)
+                continue
+            try:
+                # post from a separate thread so the next window can fill meanwhile
+                threading.Thread(target=self._dispatch, args=(batch,), daemon=True).start()
+            except RuntimeError:
+                self._scatter(batch, None)
+
+    def _dispatch(self, batch: List[dict]) -> None:
+        results = None
+        try:
+            cached = _GOOD_ENDPOINT
+            url = cached[0] if cached is not None and cached[1] == "chat" else MODEL_URLS[0]
+            r = _CLIENT.post(url, content=orjson.dumps({"messages_batch": [item["payload"] for item in batch]}))
+            if 400 <= r.status_code < 500:
+                self.supported = False
+            elif r.status_code == 200:
+                try:
+                    responses = orjson.loads(r.content).get("responses")
+                except (orjson.JSONDecodeError, AttributeError):
+                    responses = None
+                if isinstance(responses, list) and len(responses) == len(batch):
+                    results = [(True, extract_reply_text(resp)) for resp in responses]
+                else:
+                    # server answered as if it were a single request: no batch support
+                    self.supported = False
+        except Exception:
+            results = None
+        finally:
+            self._scatter(batch, results)
+
+    @staticmethod
+    def _scatter(batch: List[dict], results: Optional[List[Tuple[bool, str]]]) -> None:
+        for i, item in enumerate(batch):
+            item["result"] = results[i] if results else None
+            item["done"].set()
+
+
+_BATCHER = _BatchDispatcher()
+
+
+def _probe_endpoint(url: str, chat_json: bytes, inputs_json: bytes) -> Tuple[bool, str, Optional[Tuple[str, str]]]:
+    """
+    Try one candidate endpoint: up to 3 attempts with short backoff, falling back
+    to the 'inputs' payload shape when the chat shape is rejected.
+    Returns (ok, text_or_last_error, (url, shape) on success).
+    """
+    last_err = None
+    for attempt in range(3):
+        try:
+            # typical chat completions payload
+            r = _CLIENT.post(url, content=chat_json)
+
+            # If 200 OK, parse
+            if r.status_code == 200:
+                return True, _read_model_reply(r), (url, "chat")
+
+            # If Not Found -> endpoint not served, caller moves on (no heavy backoff)
+            if r.status_code == 404:
+                return False, f"{url} returned 404 Not Found", None
+
+            # For recoverable errors, do small backoff and retry
+            if r.status_code in (408, 409, 429, 500, 502, 503, 504):
+                last_err = f"{url} returned {r.status_code}: {r.text}"
+                time.sleep(0.6 * (attempt + 1))
+                continue
+
+            # Otherwise try fallback 'inputs' shape (some servers expect this)
+            r2 = _CLIENT.post(url, content=inputs_json)
+            if r2.status_code == 200:
+                return True, _read_model_reply(r2), (url, "inputs")
+
+            # If r2 also 404 then the endpoint is not supported, otherwise record last_err and maybe retry
+            if r2.status_code == 404:
+                return False, f"{url} (inputs) returned 404", None
+
+            last_err = f"{url} returned {r.status_code}: {r.text}"
+
+        except httpx.HTTPError as exc:
+            last_err = str(exc)
+            # small backoff before retrying
+            time.sleep(0.5 * (attempt + 1))
+        except Exception as e:
+            last_err = str(e)
+            time.sleep(0.5 * (attempt + 1))
+
+    return False, last_err, None
+
+
+def _prepare_messages(prompt: str, messages=None) -> List[dict]:
+    """Build trimmed role/content pairs for the model, defaulting to a single user message."""
+    safe_messages = None
+    if messages:
+        # build role/content pairs and trim
+        safe_messages = [{"role": m.get("role", "user"), "content": str(m.get("content", ""))} for m in messages]
+        safe_messages = trim_messages(safe_messages)
+
+    # If messages were not provided, send single user message
+    if not safe_messages:
+        safe_messages = [{"role": "user", "content": prompt}]
+    return safe_messages
+
+
 def call_model(prompt: str,
                max_tokens: int = 256,
                stop=None,
@@ -141,93 +462,153 @@ def call_model(prompt: str,
     Try contacting the model server using a list of candidate endpoints and payload shapes.
     Implements:
       - trimming of message history
+      - optional coalescing of concurrent calls into one batch request (MODEL_BATCHING)
+      - reuse of the last endpoint that worked (probing only on failure)
+      - hedged probing: the first HEDGE_WIDTH candidates are tried concurrently
       - retries with small exponential backoff on recoverable errors
       - fallback to alternate payload shape ('inputs')
       - robust JSON/text parsing
     Returns (ok, text_or_error_message)
     """
     last_err = None
+    safe_messages = _prepare_messages(prompt, messages)
+
+    # Build both payload shapes once; only the url changes between attempts.
+    # Bodies are serialized up front and sent as raw content (Content-Type is set on _CLIENT).
+    chat_payload = {
+        "model": "local-model",
+        "messages": safe_messages,
+        "max_tokens": max_tokens,
+        "temperature": temperature,
+    }
+    inputs_payload = {"inputs": prompt, "parameters": {"max_new_tokens": max_tokens, "temperature": temperature}}
+    chat_json = orjson.dumps(chat_payload)
+    inputs_json = orjson.dumps(inputs_payload)
+
+    if MODEL_BATCHING:
+        result = _BATCHER.submit(chat_payload)
+        if result is not None:
+            return result
+
+    # Fast path: single try against the endpoint that answered last time
+    cached = _GOOD_ENDPOINT
+    if cached is not None:
+        url, shape = cached
+        try:
+            r = _CLIENT.post(url, content=chat_json if shape == "chat" else inputs_json)
+            if r.status_code == 200:
+                return True, _read_model_reply(r)
+            last_err = f"{url} returned {r.status_code}: {r.text}"
+        except httpx.HTTPError as exc:
+            last_err = str(exc)
+
+    # No working cached endpoint: race the most likely candidates, first 200 wins
+    hedged = [_HEDGE_POOL.submit(_probe_endpoint, url, chat_json, inputs_json) for url in MODEL_URLS[:HEDGE_WIDTH]]
+    for fut in as_completed(hedged):
+        ok, text, winner = fut.result()
+        if ok:
+            # losers may still be in flight; their results are ignored
+            for other in hedged:
+                other.cancel()
+            _remember_endpoint(*winner)
+            return True, text
+        last_err = text
+
+    # Remaining candidates are probed one at a time
+    for url in MODEL_URLS[HEDGE_WIDTH:]:
+        ok, text, winner = _probe_endpoint(url, chat_json, inputs_json)
+        if ok:
+            _remember_endpoint(*winner)
+            return True, text
+        last_err = text
 
-    # prepare messages payload safely
-    safe_messages = None
-    if messages:
-        # build role/content pairs and trim
-        safe_messages = [{"role": m.get("role", "user"), "content": str(m.get("content", ""))} for m in messages]
-        safe_messages = trim_messages(safe_messages)
+    return False, f"Failed to contact model. Last error: {last_err}"
 
-    # If messages were not provided, send single user message
-    if not safe_messages:
-        safe_messages = [{"role": "user", "content": prompt}]
 
-    headers = {"Content-Type": "application/json", "Accept": "application/json"}
+def _buffered_reply(prompt: str, max_tokens: int, temperature: float, messages: List[dict]) -> str:
+    """Non-streaming call across all candidate endpoints; raises RuntimeError on failure."""
+    ok, text = call_model(prompt, max_tokens=max_tokens, temperature=temperature, messages=messages)
+    if not ok:
+        raise RuntimeError(text)
+    return text
 
-    for url in MODEL_URLS:
-        # Try up to 3 attempts per endpoint (short backoff)
-        for attempt in range(3):
-            try:
-                # Build typical chat completions payload
-                payload = {
-                    "model": "local-model",
-                    "messages": safe_messages,
-                    "max_tokens": max_tokens,
-                    "temperature": temperature,
-                }
-
-                r = requests.post(url, json=payload, headers=headers, timeout=60)
-
-                # If 200 OK, parse
-                if r.status_code == 200:
-                    # Try JSON parse, fallback to plain text
-                    try:
-                        j = r.json()
-                        text, raw = extract_text_from_model_response(j)
-                        # successful
-                        return True, text
-                    except Exception:
-                        # not JSON — return raw text body
-                        return True, r.text
-
-                # If Not Found -> try next endpoint (no heavy backoff)
-                if r.status_code == 404:
-                    last_err = f"{url} returned 404 Not Found"
-                    # try next url without waiting
-                    break
 
-                # For recoverable errors, do small backoff and retry
-                if r.status_code in (408, 409, 429, 500, 502, 503, 504):
-                    last_err = f"{url} returned {r.status_code}: {r.text}"
-                    time.sleep(0.6 * (attempt + 1))
-                    continue
-
-                # Otherwise try fallback 'inputs' shape (some servers expect this)
-                payload_inputs = {"inputs": prompt, "parameters": {"max_new_tokens": max_tokens, "temperature": temperature}}
-                r2 = requests.post(url, json=payload_inputs, headers=headers, timeout=60)
-                if r2.status_code == 200:
-                    try:
-                        j2 = r2.json()
-                        text2, raw2 = extract_text_from_model_response(j2)
-                        return True, text2
-                    except Exception:
-                        return True, r2.text
-
-                # If r2 also 404 then break (endpoint not supported), otherwise record last_err and maybe retry
-                if r2.status_code == 404:
-                    last_err = f"{url} (inputs) returned 404"
-                    break
+def stream_model(prompt: str,
+                 max_tokens: int = 256,
+                 temperature: float = 0.2,
+                 messages=None) -> Iterator[str]:
+    """
+    Stream a chat completion from the model server, yielding text chunks as they arrive.
+    Uses the cached endpoint when it speaks the chat shape, otherwise the first candidate
+    not known to reject streaming. When no endpoint can stream (cached 'inputs' shape,
+    4xx, error status or a plain JSON body), the whole reply is yielded at once,
+    falling back to call_model() when needed.
+    Raises RuntimeError if the model cannot be reached at all.
+    """
+    safe_messages = _prepare_messages(prompt, messages)
+    cached = _GOOD_ENDPOINT
+    if cached is not None:
+        url = cached[0] if cached[1] == "chat" and cached[0] not in _NO_STREAM_URLS else None
+    else:
+        url = next((u for u in MODEL_URLS if u not in _NO_STREAM_URLS), None)
+
+    if url is None:
+        # nothing to stream from: go straight to the buffered path
+        yield _buffered_reply(prompt, max_tokens, temperature, safe_messages)
+        return
+
+    payload = {
+        "model": "local-model",
+        "messages": safe_messages,
+        "max_tokens": max_tokens,
+        "temperature": temperature,
+        "stream": True,
+    }
 
-                last_err = f"{url} returned {r.status_code}: {r.text}"
+    try:
+        r = _CLIENT.send(
+            _CLIENT.build_request("POST", url, content=orjson.dumps(payload), timeout=httpx.Timeout(MODEL_STREAM_READ_TIMEOUT, connect=MODEL_CONNECT_TIMEOUT)),
+            stream=True,
+        )
+    except httpx.HTTPError:
+        r = None
+
+    if r is None or r.status_code != 200:
+        if r is not None:
+            if 400 <= r.status_code < 500:
+                # missing endpoint or "stream" rejected: don't send a doomed request here on every chat
+                _NO_STREAM_URLS.add(url)
+            r.close()
+        yield _buffered_reply(prompt, max_tokens, temperature, safe_messages)
+        return
 
-            except requests.RequestException as re:
-                last_err = str(re)
-                # small backoff before retrying
-                time.sleep(0.5 * (attempt + 1))
+    try:
+        _remember_endpoint(url, "chat")
+        if "text/event-stream" not in r.headers.get("Content-Type", ""):
+            # server ignored "stream": the body is a regular completion
+            r.read()
+            yield _read_model_reply(r)
+            return
+        for line in r.iter_lines():
+            # SSE frames look like "data: {...}"; skip keep-alives and other fields
+            if not line.startswith("data:"):
                 continue
-            except Exception as e:
-                last_err = str(e)
-                time.sleep(0.5 * (attempt + 1))
+            data = line[5:].strip()
+            if data == "[DONE]":
+                break
+            try:
+                chunk = orjson.loads(data)
+                choice = chunk["choices"][0]
+            except (orjson.JSONDecodeError, KeyError, IndexError, TypeError):
                 continue
-
-    return False, f"Failed to contact model. Last error: {last_err}"
+            # chat streams carry delta.content, completion streams carry text
+            text = (choice.get("delta") or {}).get("content") or choice.get("text")
+            if text:
+                yield text
+    except httpx.HTTPError as exc:
+        raise RuntimeError(str(exc))
+    finally:
+        r.close()
 
 
 # -----------------------------
@@ -240,11 +621,7 @@ def home():
 
 @app.route("/api/sessions", methods=["GET"])
 def api_sessions_list():
-    ordered = [
-        {"id": s["id"], "name": s["name"], "created": s["created"]}
-        for s in sort_sessions()
-    ]
-    return jsonify({"sessions": ordered})
+    return jsonify({"sessions": store.list()})
 
 
 @app.route("/api/sessions", methods=["POST"])
@@ -257,22 +634,22 @@ def api_sessions_create():
 
 @app.route("/api/sessions/<sid>", methods=["GET"])
 def api_sessions_get(sid):
-    if sid not in sessions:
+    s = store.get(sid)
+    if s is None:
         return jsonify({"error": "not_found"}), 404
-    return jsonify({"session": sessions[sid]})
+    return jsonify({"session": {"id": s["id"], "name": s["name"], "created": s["created"], "messages": s["messages"]}})
 
 
 @app.route("/api/sessions/<sid>", methods=["DELETE"])
 def api_sessions_delete(sid):
-    if sid in sessions:
-        del sessions[sid]
+    if store.delete(sid):
         return jsonify({"deleted": True})
     return jsonify({"deleted": False}), 404
 
 
 @app.route("/api/sessions/<sid>", methods=["PATCH"])
 def api_sessions_rename(sid):
-    if sid not in sessions:
+    if not store.exists(sid):
         return jsonify({"error": "not_found"}), 404
 
     data = request.get_json(force=True) or {}
@@ -280,10 +657,48 @@ def api_sessions_rename(sid):
     if not name:
         return jsonify({"error": "empty_name"}), 400
 
-    sessions[sid]["name"] = name
+    if not store.rename(sid, name):
+        # deleted between the check and the update
+        return jsonify({"error": "not_found"}), 404
     return jsonify({"renamed": True, "session": {"id": sid, "name": name}})
 
 
+def _sse(obj: dict) -> bytes:
+    """Encode one server-sent event."""
+    return b"data: " + orjson.dumps(obj) + b"\n\n"
+
+
+def _stream_chat(session_id: str, prompt: str, max_tokens: int, context: List[dict]) -> Iterator[bytes]:
+    """
+    Relay model chunks to the client as {"delta": ...} events, then store the full
+    reply and finish with a {"done": true, ...} event carrying the complete response,
+    or an "error" field if anything fails after the response has started.
+    """
+    parts = []
+    try:
+        try:
+            for chunk in stream_model(prompt, max_tokens=max_tokens, messages=context):
+                parts.append(chunk)
+                yield _sse({"delta": chunk})
+        except RuntimeError as e:
+            # keep any partial output, but set the error apart from it
+            if parts:
+                parts.append("\n\n")
+            parts.append(f"[Model error] {e}")
+
+        assistant_text = "".join(parts)
+
+        # store assistant reply only once the stream has completed
+        record_message(session_id, "assistant", assistant_text)
+    except Exception as e:
+        # the response has already started; report the failure as the final event
+        logger.exception("api_chat stream failed")
+        yield _sse({"done": True, "session_id": session_id, "error": str(e)})
+        return
+
+    yield _sse({"done": True, "session_id": session_id, "response": assistant_text})
+
+
 @app.route("/api/chat", methods=["POST"])
 def api_chat():
     try:
@@ -292,30 +707,34 @@ def api_chat():
         session_id = data.get("session_id")
         max_tokens = int(data.get("max_tokens", 256))
 
-        if not session_id or session_id not in sessions:
-            s = create_session()
-            session_id = s["id"]
-
-        session = sessions[session_id]
+        # only the newest rows are read; call_model/stream_model trim them to the model's budget
+        history = store.recent(session_id, MAX_MESSAGES - 1) if session_id else None
+        if history is None:
+            session_id = create_session()["id"]
+            history = []
 
         # record user message
-        session["messages"].append({"role": "user", "content": prompt, "time": time.time()})
+        record_message(session_id, "user", prompt)
+        context = history + [{"role": "user", "content": prompt}]
 
-        # build messages for model (trimmed)
-        messages_for_model = [{"role": m["role"], "content": m["content"]} for m in session["messages"]]
-        messages_for_model = trim_messages(messages_for_model)
+        if data.get("stream"):
+            return Response(
+                _stream_chat(session_id, prompt, max_tokens, context),
+                mimetype="text/event-stream",
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+            )
 
-        ok, model_resp = call_model(prompt, max_tokens=max_tokens, messages=messages_for_model)
+        ok, model_resp = call_model(prompt, max_tokens=max_tokens, messages=context)
 
         assistant_text = model_resp if ok else f"[Model error] {model_resp}"
 
         # store assistant reply
-        session["messages"].append({"role": "assistant", "content": assistant_text, "time": time.time()})
+        record_message(session_id, "assistant", assistant_text)
 
         return jsonify({"session_id": session_id, "response": assistant_text})
 
     except Exception as e:
-        traceback.print_exc()
+        logger.exception("api_chat failed")
         return jsonify({"error": str(e)}), 500
 
 
@@ -328,23 +747,34 @@ def api_password_check():
         suggestions = []
         if not pw:
             return jsonify({"score": 0, "suggestions": ["Empty password"]})
+        # one pass over the distinct characters instead of an any() per check
+        has_upper = has_lower = has_digit = has_symbol = False
+        for c in set(pw):
+            if c.isupper():
+                has_upper = True
+            if c.islower():
+                has_lower = True
+            if c.isdigit():
+                has_digit = True
+            if not c.isalnum():
+                has_symbol = True
         if len(pw) >= 12:
             score += 4
-        if any(c.isupper() for c in pw):
+        if has_upper:
             score += 2
-        if any(c.islower() for c in pw):
+        if has_lower:
             score += 1
-        if any(c.isdigit() for c in pw):
+        if has_digit:
             score += 2
-        if any(not c.isalnum() for c in pw):
+        if has_symbol:
             score += 1
         if len(pw) < 12:
             suggestions.append("Use at least 12 characters.")
-        if not any(c.isdigit() for c in pw):
+        if not has_digit:
             suggestions.append("Add digits.")
-        if not any(c.isupper() for c in pw):
+        if not has_upper:
             suggestions.append("Add uppercase letters.")
-        if not any(not c.isalnum() for c in pw):
+        if not has_symbol:
             suggestions.append("Add symbols.")
         score = min(10, max(1, int((score / 10) * 10)))
         return jsonify({"score": score, "suggestions": suggestions})
@@ -352,6 +782,10 @@ def api_password_check():
         return jsonify({"error": str(e)}), 500
 
 
+# URL and urgency markers matched in one case-insensitive pass
+_SCAN_RE = re.compile(r"(?P<url>https?://)|(?P<urg>urgent|immediately)", re.IGNORECASE)
+
+
 @app.route("/api/scan-text", methods=["POST"])
 def api_scan_text():
     try:
@@ -359,10 +793,18 @@ def api_scan_text():
         text = data.get("text", "")
         issues = []
         score = 0
-        if "http://" in text or "https://" in text:
+        saw_url = saw_urgent = False
+        for m in _SCAN_RE.finditer(text):
+            if m.lastgroup == "url":
+                saw_url = True
+            else:
+                saw_urgent = True
+            if saw_url and saw_urgent:
+                break
+        if saw_url:
             issues.append("URL(s) detected")
             score += 30
-        if "urgent" in text.lower() or "immediately" in text.lower():
+        if saw_urgent:
             issues.append("Urgent language")
             score += 20
         return jsonify({"score": min(100, score), "issues": issues})
@@ -374,8 +816,7 @@ def api_scan_text():
 def api_session_clear():
     data = request.get_json(force=True)
     sid = data.get("session_id")
-    if sid and sid in sessions:
-        sessions[sid]["messages"] = []
+    if sid and store.clear(sid):
         return jsonify({"cleared": True})
     return jsonify({"cleared": False}), 404
 
@@ -383,9 +824,10 @@ def api_session_clear():
 @app.route("/health")
 def health():
     ok, _ = call_model("Hello", max_tokens=5)
-    return jsonify({"model_reachable": ok, "sessions_count": len(sessions)})
+    return jsonify({"model_reachable": ok, "sessions_count": store.count()})
 
 
 if __name__ == "__main__":
+    # development only; use `gunicorn app:app` for concurrent serving
     print("Flask running on port 5001")
-    app.run(host="0.0.0.0", port=5001, debug=True)
+    app.run(host="0.0.0.0", port=5001, debug=True, threaded=True)
@@ -0,0 +1,12 @@
+# gunicorn.conf.py
+"""
+Production server settings for app.py.
+Run with:  gunicorn app:app
+Threads overlap the long waits on the model server (socket I/O releases the GIL
+while waiting), so one worker can serve many pending chats at once.
+"""
+bind = "0.0.0.0:5001"
+worker_class = "gthread"
+# Sessions live in SQLite (session_store.py), so workers can share them.
+workers = 2
+threads = 16
@@ -219,6 +219,27 @@ function addMessageToUI(role, text) {
   wrapper.appendChild(msg);
   messagesDiv.appendChild(wrapper);
   messagesDiv.scrollTop = messagesDiv.scrollHeight;
+  return msg;
+}
+
+// read a text/event-stream body, calling onEvent with each parsed data: payload
+async function readEventStream(res, onEvent) {
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    let idx;
+    while ((idx = buffer.indexOf("\n\n")) !== -1) {
+      const frame = buffer.slice(0, idx);
+      buffer = buffer.slice(idx + 2);
+      frame.split("\n").forEach(line => {
+        if (line.startsWith("data:")) onEvent(JSON.parse(line.slice(5)));
+      });
+    }
+  }
 }
 
 async function sendMessage() {
@@ -264,17 +285,42 @@ async function sendMessage() {
     const res = await fetch("/api/chat", {
       method: "POST",
       headers: {"Content-Type":"application/json"},
-      body: JSON.stringify({ prompt: text, session_id: currentSessionId })
+      body: JSON.stringify({ prompt: text, session_id: currentSessionId, stream: true })
     });
-    const data = await res.json();
-    wrap.remove();
 
-    if (data.error) {
-      addMessageToUI("assistant", "Error: " + data.error);
-    } else {
-      currentSessionId = data.session_id || currentSessionId;
-      addMessageToUI("assistant", data.response);
+    if ((res.headers.get("Content-Type") || "").startsWith("text/event-stream")) {
+      // render the reply as chunks arrive
+      let botMsg = null;
+      await readEventStream(res, evt => {
+        if (evt.delta) {
+          if (!botMsg) {
+            wrap.remove();
+            botMsg = addMessageToUI("assistant", "");
+          }
+          botMsg.textContent += evt.delta;
+          messagesDiv.scrollTop = messagesDiv.scrollHeight;
+        }
+        if (evt.done) {
+          currentSessionId = evt.session_id || currentSessionId;
+          wrap.remove();
+          const finalText = evt.error ? "Error: " + evt.error : evt.response;
+          if (!botMsg) botMsg = addMessageToUI("assistant", finalText);
+          else botMsg.textContent = finalText;
+        }
+      });
+      wrap.remove();
       await loadSessions();
+    } else {
+      const data = await res.json();
+      wrap.remove();
+
+      if (data.error) {
+        addMessageToUI("assistant", "Error: " + data.error);
+      } else {
+        currentSessionId = data.session_id || currentSessionId;
+        addMessageToUI("assistant", data.response);
+        await loadSessions();
+      }
     }
   } catch (err) {
     console.error("send error", err);
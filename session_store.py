@@ -0,0 +1,210 @@
+# session_store.py
+"""
+SQLite-backed chat session store, shared by every worker process.
+WAL mode lets readers and writers in different workers proceed without blocking
+each other. Sessions idle for longer than the TTL are deleted by a sweeper thread.
+"""
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional, List
+
+SESSION_TTL = 86_400      # seconds a session may sit untouched before it is swept
+SWEEP_INTERVAL = 600      # seconds between sweeper runs
+MAX_SESSIONS = 10_000     # least recently updated sessions beyond this are evicted by the sweeper
+
+
+class SessionStore:
+    """
+    Sessions are plain dicts: {"id", "name", "created", "messages"}.
+    Messages live in their own table and are only ever appended, so concurrent
+    requests on one session never overwrite each other, and writes to a deleted
+    session are dropped instead of bringing it back. Only create() inserts sessions.
+    Each sweep evicts the least recently updated sessions beyond max_sessions, so
+    the cap may be exceeded by the sessions created since the last sweep.
+    """
+
+    def __init__(self, path: str = "sessions.db",
+                 ttl: float = SESSION_TTL,
+                 sweep_interval: float = SWEEP_INTERVAL,
+                 max_sessions: int = MAX_SESSIONS):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        # one shared connection in autocommit mode; the lock serialises threads
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("PRAGMA foreign_keys=ON")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                " id TEXT PRIMARY KEY,"
+                " name TEXT NOT NULL,"
+                " created REAL NOT NULL,"
+                " updated REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS sessions_updated ON sessions (updated)")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS messages ("
+                " id INTEGER PRIMARY KEY,"
+                " session_id TEXT NOT NULL REFERENCES sessions (id) ON DELETE CASCADE,"
+                " role TEXT NOT NULL,"
+                " content TEXT NOT NULL,"
+                " time REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS messages_session ON messages (session_id, id)")
+
+        if sweep_interval:
+            t = threading.Thread(target=self._sweep_loop, args=(sweep_interval,),
+                                 name="session-sweeper", daemon=True)
+            t.start()
+
+    @contextmanager
+    def _transaction(self):
+        """Hold the thread lock and SQLite's write lock (BEGIN IMMEDIATE) for a multi-statement write."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def get(self, sid: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, name, created FROM sessions WHERE id = ?", (sid,)
+            ).fetchone()
+            if row is None:
+                return None
+            messages = self._conn.execute(
+                "SELECT role, content, time FROM messages WHERE session_id = ? ORDER BY id", (sid,)
+            ).fetchall()
+        return {
+            "id": row[0],
+            "name": row[1],
+            "created": row[2],
+            "messages": [{"role": m[0], "content": m[1], "time": m[2]} for m in messages],
+        }
+
+    def recent(self, sid: str, limit: int) -> Optional[List[dict]]:
+        """
+        Return the newest `limit` messages of a session as role/content pairs, oldest
+        first, reading only those rows off the (session_id, id) index.
+        Returns None if the session does not exist.
+        """
+        with self._lock:
+            if self._conn.execute("SELECT 1 FROM sessions WHERE id = ?", (sid,)).fetchone() is None:
+                return None
+            rows = self._conn.execute(
+                "SELECT role, content FROM messages WHERE session_id = ? ORDER BY id DESC LIMIT ?",
+                (sid, limit),
+            ).fetchall()
+        return [{"role": r[0], "content": r[1]} for r in reversed(rows)]
+
+    def exists(self, sid: str) -> bool:
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM sessions WHERE id = ?", (sid,)).fetchone() is not None
+
+    def create(self, session: dict) -> None:
+        """
+        Insert a new session. An empty name is replaced by "Chat N", numbered after
+        the highest rowid (an index lookup, unlike COUNT(*) which scans the table).
+        """
+        with self._lock:
+            if not session["name"]:
+                last = self._conn.execute("SELECT MAX(rowid) FROM sessions").fetchone()[0]
+                session["name"] = f"Chat {(last or 0) + 1}"
+            self._conn.execute(
+                "INSERT INTO sessions (id, name, created, updated) VALUES (?, ?, ?, ?)",
+                (session["id"], session["name"], session["created"], time.time()),
+            )
+
+    def append(self, sid: str, message: dict, keep: int = 0) -> bool:
+        """
+        Append one message to an existing session, keeping only its newest `keep`
+        messages when keep > 0. Returns False (and writes nothing) if the session is gone.
+        """
+        with self._transaction() as conn:
+            cur = conn.execute("UPDATE sessions SET updated = ? WHERE id = ?", (time.time(), sid))
+            if cur.rowcount == 0:
+                return False
+            conn.execute(
+                "INSERT INTO messages (session_id, role, content, time) VALUES (?, ?, ?, ?)",
+                (sid, message["role"], message["content"], message["time"]),
+            )
+            if keep > 0:
+                conn.execute(
+                    "DELETE FROM messages WHERE session_id = ? AND id <= "
+                    "(SELECT id FROM messages WHERE session_id = ? ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                    (sid, sid, keep),
+                )
+        return True
+
+    def clear(self, sid: str) -> bool:
+        """Delete every message of a session; returns False if the session does not exist."""
+        with self._transaction() as conn:
+            cur = conn.execute("UPDATE sessions SET updated = ? WHERE id = ?", (time.time(), sid))
+            if cur.rowcount == 0:
+                return False
+            conn.execute("DELETE FROM messages WHERE session_id = ?", (sid,))
+        return True
+
+    def rename(self, sid: str, name: str) -> bool:
+        with self._lock:
+            cur = self._conn.execute(
+                "UPDATE sessions SET name = ?, updated = ? WHERE id = ?", (name, time.time(), sid)
+            )
+        return cur.rowcount > 0
+
+    def delete(self, sid: str) -> bool:
+        with self._lock:
+            cur = self._conn.execute("DELETE FROM sessions WHERE id = ?", (sid,))
+        return cur.rowcount > 0
+
+    def list(self) -> List[dict]:
+        """
+        Return session summaries (no messages), oldest first.
+        Sessions are only ever appended, so rowid order is creation order and
+        SQLite reads it straight off the table without a sort step.
+        """
+        with self._lock:
+            rows = self._conn.execute("SELECT id, name, created FROM sessions ORDER BY rowid").fetchall()
+        return [{"id": r[0], "name": r[1], "created": r[2]} for r in rows]
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+    def sweep(self) -> int:
+        """
+        Delete sessions not updated within the TTL, then the least recently updated
+        ones beyond max_sessions; returns the number removed.
+        """
+        with self._lock:
+            expired = self._conn.execute(
+                "DELETE FROM sessions WHERE updated < ?", (time.time() - self.ttl,)
+            ).rowcount
+            # walks the 'updated' index; the subquery is NULL (no-op) while under the cap
+            evicted = self._conn.execute(
+                "DELETE FROM sessions WHERE updated < "
+                "(SELECT updated FROM sessions ORDER BY updated DESC LIMIT 1 OFFSET ?)",
+                (self.max_sessions - 1,),
+            ).rowcount
+        return expired + evicted
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def _sweep_loop(self, interval: float) -> None:
+        while True:
+            time.sleep(interval)
+            try:
+                self.sweep()
+            except sqlite3.Error:
+                # database busy/closed; try again next round
+                pass